@@ -1,28 +1,64 @@
 import os
+import io
+import hmac
 import logging
+import logging.handlers
 import pandas as pd
 import tempfile
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import re # Import regular expressions for more advanced sanitization
-from flask import Flask, request, jsonify, send_file, make_response, after_this_request
+import xlsxwriter
+from flask import Flask, request, jsonify, send_file, make_response
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+try:
+    import python_calamine  # noqa: F401
+    _CALAMINE_AVAILABLE = True
+except ImportError:
+    _CALAMINE_AVAILABLE = False
+
 load_dotenv()
 
 # --- Logging Configuration ---
+# INFO records are buffered in memory and flushed in batches (or immediately
+# once an ERROR arrives), so hot request paths are not serialized on stderr
+# writes. Set LOG_BUFFER_CAPACITY=1 to get the old line-at-a-time behavior.
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+_root_logger = logging.getLogger()
+_stream_handler = _root_logger.handlers[0]
+_buffered_handler = logging.handlers.MemoryHandler(
+    capacity=int(os.environ.get("LOG_BUFFER_CAPACITY", "1024")),
+    flushLevel=logging.ERROR,
+    target=_stream_handler,
+)
+_root_logger.removeHandler(_stream_handler)
+_root_logger.addHandler(_buffered_handler)
+
+# Compiled once at import instead of per request in generate_output_download_name.
+_SANITIZE_KEEP_RE = re.compile(r'[^\w\s-]')
+_WS_COLLAPSE_RE = re.compile(r'\s+')
 
 # --- Configuration ---
 EXPECTED_PASSWORD = os.environ.get("APP_PASSWORD", "yourSuperSecretPassword123")
 if EXPECTED_PASSWORD == "yourSuperSecretPassword123":
     logging.warning("Using default APP_PASSWORD. Please change this for production!")
+# Encoded once at import; compare_digest wants bytes and runs in constant time.
+_EXPECTED_PW_BYTES = EXPECTED_PASSWORD.encode()
 
 UPLOAD_FOLDER_BASE = 'uploads_temp'
-PROCESSED_FOLDER_BASE = 'processed_temp'
 os.makedirs(UPLOAD_FOLDER_BASE, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER_BASE, exist_ok=True)
 
 app = Flask(__name__)
+# Cap upload size so a single oversized file cannot exhaust worker memory, and
+# keep the multipart parser's in-memory buffer small so bodies spool to disk.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+app.config['MAX_FORM_MEMORY_SIZE'] = 1024 * 1024
 
 # --- CORS Configuration ---
 # This configuration allows your frontend to make requests and to read the Content-Disposition header.
@@ -46,15 +82,34 @@ CORS(app, resources={
     }
 })
 
+# str.endswith takes a tuple, so both extensions are checked in one C-level
+# call; lowercasing first makes the check case-insensitive ('.XLSX' uploads
+# from Windows clients were previously rejected).
+_ALLOWED_UPLOAD_EXTS = ('.xlsx', '.xls')
+
 def _remove_file(path):
+    # Single unlink instead of exists()+remove(): one syscall fewer and no
+    # TOCTOU race between the existence check and the delete.
+    if not path:
+        return
     try:
-        if path and os.path.exists(path):
-            os.remove(path)
-            app.logger.info(f"Successfully removed temp file: {path}")
+        os.unlink(path)
+        app.logger.info("Successfully removed temp file: %s", path)
+    except FileNotFoundError:
+        pass
     except OSError as e:
         app.logger.error(f"Error removing temp file {path}: {e}", exc_info=True)
-    except Exception as e:
-        app.logger.error(f"Unexpected error removing temp file {path}: {e}", exc_info=True)
+
+_BOOL_STRING_MAP = {
+    "true": True, "yes": True, "1": True, "t": True, "on": True,
+    "false": False, "no": False, "0": False, "f": False, "off": False,
+}
+_BOOL_NUMERIC_MAP = {True: True, False: False, 1: True, 0: False, 1.0: True, 0.0: False}
+
+def _normalize_boolean_series(s):
+    """Vectorized equivalent of normalize_boolean over a whole Series."""
+    as_str = s.astype('string').str.strip().str.lower().map(_BOOL_STRING_MAP)
+    return as_str.where(as_str.notna(), s.map(_BOOL_NUMERIC_MAP))
 
 def normalize_boolean(value):
     if isinstance(value, bool): return value
@@ -69,10 +124,15 @@ def normalize_boolean(value):
     if pd.isna(value): return None
     return None
 
+@lru_cache(maxsize=256)
 def generate_output_download_name(original_input_basename):
     """
     Generates a sanitized output filename for download, ensuring it cleanly ends with '.xlsx'.
     More aggressively sanitizes the prefix part of the filename.
+
+    Pure function of its input, so results are memoized: re-uploads of the
+    same file (a common iteration pattern) skip the sanitization entirely.
+    Callers log the resulting name where it matters.
     """
     if not original_input_basename:
         app.logger.warning("generate_output_download_name called with no basename, using default.")
@@ -85,8 +145,16 @@ def generate_output_download_name(original_input_basename):
     # Allow alphanumeric characters, spaces, and hyphens. Replace others.
     # Convert to string first to handle potential non-string inputs if any.
     sanitized_base = str(name_part_without_ext)
-    sanitized_base = re.sub(r'[^\w\s-]', '', sanitized_base) # Keep word chars, whitespace, hyphens
-    sanitized_base = re.sub(r'\s+', ' ', sanitized_base).strip() # Collapse multiple spaces, strip ends
+    # Fast path: typical school filenames ("Acme HS - StudentParent Information")
+    # are already clean, so both regexes would be no-ops. Only fall through to
+    # them when the name actually contains characters or spacing to fix.
+    is_clean = (sanitized_base.isascii()
+                and sanitized_base == sanitized_base.strip()
+                and '  ' not in sanitized_base
+                and all(c.isalnum() or c in ' -' for c in sanitized_base))
+    if not is_clean:
+        sanitized_base = _SANITIZE_KEEP_RE.sub('', sanitized_base) # Keep word chars, whitespace, hyphens
+        sanitized_base = _WS_COLLAPSE_RE.sub(' ', sanitized_base).strip() # Collapse multiple spaces, strip ends
 
     # Use the existing logic to determine the prefix from this sanitized base
     parts = sanitized_base.split('-', 1)
@@ -106,20 +174,80 @@ def generate_output_download_name(original_input_basename):
     # Construct the final name, explicitly appending ".xlsx"
     final_download_name = f"{prefix}- Brevo Contacts.xlsx"
     
-    app.logger.info(f"Original basename: '{original_input_basename}'")
-    app.logger.info(f"Name part without ext: '{name_part_without_ext}'")
-    app.logger.info(f"Sanitized base for prefix: '{sanitized_base}'")
-    app.logger.info(f"Calculated prefix: '{prefix}'")
-    app.logger.info(f"Final generated download name: '{final_download_name}' (Length: {len(final_download_name)})")
-    # For intense debugging, uncomment to see ASCII values:
-    # app.logger.info(f"ASCII values for final_download_name: {[ord(c) for c in final_download_name]}")
-    
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("Original basename: '%s'", original_input_basename)
+        app.logger.debug("Sanitized base for prefix: '%s'", sanitized_base)
+        app.logger.debug("Calculated prefix: '%s'", prefix)
+
     return final_download_name
 
-def process_uploaded_spreadsheet(input_server_filepath, output_server_filepath):
+def _read_input_excel(filepath, **kwargs):
+    """Read an Excel file, preferring the Rust-based calamine engine.
+
+    calamine streams the sheet instead of building openpyxl's full workbook
+    object model, which makes it several times faster on large uploads. Falls
+    back to the pandas default engine (openpyxl/xlrd) if calamine is not
+    installed or cannot parse the file.
+    """
+    if _CALAMINE_AVAILABLE:
+        try:
+            return pd.read_excel(filepath, engine='calamine', **kwargs)
+        except Exception as e:
+            app.logger.warning(f"calamine engine failed for {filepath} ({e}); retrying with default engine.")
+    return pd.read_excel(filepath, **kwargs)
+
+def _write_output_excel(output_df, output_target):
+    """Write a DataFrame to xlsx (path or file-like target) with xlsxwriter
+    in constant-memory mode.
+
+    constant_memory flushes each row to disk as soon as the next one starts,
+    so the writer never holds the whole sheet in RAM like openpyxl does. It
+    requires strictly row-ordered writes, which is why rows are emitted here
+    with write_row instead of DataFrame.to_excel (pandas writes column-major).
+    """
+    # strings_to_urls off: no cell here should become a hyperlink, and skipping
+    # the URL pattern check saves a regex pass over every string cell.
+    with xlsxwriter.Workbook(output_target, {'constant_memory': True, 'strings_to_urls': False}) as workbook:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, [str(c) for c in output_df.columns])
+        cleaned = output_df.astype(object).where(output_df.notna(), None)
+        for row_num, row in enumerate(cleaned.itertuples(index=False), start=1):
+            worksheet.write_row(row_num, 0, row)
+
+EXPECTED_INPUT_COLS = ['School Name', 'SLC Name', 'ID Number', 'Student First Name', 'Student Last Name', 'Student Grade Level', 'Student Homeroom', 'Parent 1 First Name', 'Parent 1 Last Name', 'Parent 1 Email', 'Parent 1 Phone Number', 'Parent 1 Is FacultyStaff', 'Parent 1 Street Address', 'Parent 1 City', 'Parent 1 State', 'Parent 1 ZIP Code', 'Parent 2 First Name', 'Parent 2 Last Name', 'Parent 2 Email', 'Parent 2 Phone Number', 'Parent 2 Is FacultyStaff', 'Parent 2 Street Address', 'Parent 2 City', 'Parent 2 State', 'Parent 2 ZIP Code']
+_EXPECTED_INPUT_COL_SET = frozenset(EXPECTED_INPUT_COLS)
+# Low-cardinality columns become categoricals (int codes instead of N string
+# objects); IDs read as 'string' so they are never promoted to float.
+# The 'Is FacultyStaff' columns stay object so numeric 1/0 cells keep their
+# normalize_boolean semantics, and grade level stays untyped because schools
+# mix numeric grades with values like 'K'. Email and ID Number are read as
+# arrow-backed strings so the downstream strip/lower kernels and the
+# groupby/drop_duplicates hashing work on contiguous buffers instead of
+# per-cell Python objects.
+_INPUT_DTYPES = {
+    'ID Number': 'string[pyarrow]', 'School Name': 'category', 'SLC Name': 'category',
+    'Parent 1 Email': 'string[pyarrow]', 'Parent 2 Email': 'string[pyarrow]',
+    'Parent 1 State': 'category', 'Parent 2 State': 'category',
+    'Parent 1 Is FacultyStaff': object, 'Parent 2 Is FacultyStaff': object,
+}
+
+# Output schema, built once at import instead of on every request.
+MAX_STUDENTS = 4
+_STUDENT_BASE_NAMES = {"SLC Name": "SLC Name", "ID Number": "ID Number", "Student First Name": "First Name", "Student Last Name": "Last Name", "Student Grade Level": "Grade Level", "Student Homeroom": "Homeroom"}
+_PARENT_FIELD_MAP = {"First Name": "Firstname", "Last Name": "Lastname", "Phone Number": "SMS", "Is FacultyStaff": "Is FacultyStaff", "Street Address": "Street Address", "City": "City", "State": "State", "ZIP Code": "ZIP Code"}
+_PARENT_COLS = list(_PARENT_FIELD_MAP.values())
+OUTPUT_COLS = ["Email", "School Name"] + _PARENT_COLS + [
+    f"{base_name} Student {i}"
+    for i in range(1, MAX_STUDENTS + 1)
+    for base_name in _STUDENT_BASE_NAMES.values()
+]
+
+def process_uploaded_spreadsheet(input_server_filepath, output_target):
     try:
-        df = pd.read_excel(input_server_filepath, dtype={'Parent 1 Is FacultyStaff': object, 'Parent 2 Is FacultyStaff': object, 'ID Number': object, 'School Name': object})
-        app.logger.info(f"Read {len(df)} rows from {input_server_filepath}")
+        # usecols is a membership callable so unexpected columns are never
+        # parsed into the frame, while missing ones still surface below.
+        df = _read_input_excel(input_server_filepath, usecols=_EXPECTED_INPUT_COL_SET.__contains__, dtype=_INPUT_DTYPES)
+        app.logger.info("Read %d rows from %s", len(df), input_server_filepath)
     except FileNotFoundError:
         app.logger.error(f"Input file not found: {input_server_filepath}")
         return False, "Input file not found by server."
@@ -127,64 +255,161 @@ def process_uploaded_spreadsheet(input_server_filepath, output_server_filepath):
         app.logger.error(f"Error reading Excel {input_server_filepath}: {e}", exc_info=True)
         return False, f"Error reading Excel file: {e}"
 
-    expected_cols = ['School Name', 'SLC Name', 'ID Number', 'Student First Name', 'Student Last Name', 'Student Grade Level', 'Student Homeroom', 'Parent 1 First Name', 'Parent 1 Last Name', 'Parent 1 Email', 'Parent 1 Phone Number', 'Parent 1 Is FacultyStaff', 'Parent 1 Street Address', 'Parent 1 City', 'Parent 1 State', 'Parent 1 ZIP Code', 'Parent 2 First Name', 'Parent 2 Last Name', 'Parent 2 Email', 'Parent 2 Phone Number', 'Parent 2 Is FacultyStaff', 'Parent 2 Street Address', 'Parent 2 City', 'Parent 2 State', 'Parent 2 ZIP Code']
-    missing_cols = [col for col in expected_cols if col not in df.columns]
+    # Hashed set-difference in C instead of scanning the Index per expected
+    # name; sort=False keeps the error message in schema order.
+    missing_cols = list(pd.Index(EXPECTED_INPUT_COLS).difference(df.columns, sort=False))
     if missing_cols:
-        msg = f"Missing columns: {', '.join(missing_cols)}. Available: {', '.join(df.columns)}"
+        # The projected read drops unrecognized headers, so re-read just the
+        # header row to report what the upload actually contains — a typo'd
+        # name in the Available list is the clue the user needs to fix their
+        # template. Failure path only; the happy path keeps usecols.
+        if hasattr(input_server_filepath, 'seek'):
+            input_server_filepath.seek(0)
+        actual_cols = _read_input_excel(input_server_filepath, nrows=0).columns
+        msg = f"Missing columns: {', '.join(missing_cols)}. Available: {', '.join(actual_cols)}"
         app.logger.error(msg)
         return False, msg
 
-    processed_data = {}
-    max_students = 4
-    input_student_cols = ["School Name", "SLC Name", "ID Number", "Student First Name", "Student Last Name", "Student Grade Level", "Student Homeroom"]
-    output_student_base_names = {"SLC Name": "SLC Name", "ID Number": "ID Number", "Student First Name": "First Name", "Student Last Name": "Last Name", "Student Grade Level": "Grade Level", "Student Homeroom": "Homeroom"}
-
-    for _, row in df.iterrows():
-        student_info = {col: row.get(col) for col in input_student_cols}
-        school_name = student_info.get("School Name")
-        parents_this_student = []
-        for i in [1, 2]:
-            email = row.get(f'Parent {i} Email')
-            if pd.notna(email) and str(email).strip():
-                parents_this_student.append({"email": str(email).lower().strip(), "details": {"Firstname": row.get(f'Parent {i} First Name'), "Lastname": row.get(f'Parent {i} Last Name'), "SMS": row.get(f'Parent {i} Phone Number'), "Is FacultyStaff": normalize_boolean(row.get(f'Parent {i} Is FacultyStaff')), "Street Address": row.get(f'Parent {i} Street Address'), "City": row.get(f'Parent {i} City'), "State": row.get(f'Parent {i} State'), "ZIP Code": row.get(f'Parent {i} ZIP Code')}})
-        for p_info in parents_this_student:
-            email_key = p_info["email"]
-            if email_key not in processed_data:
-                processed_data[email_key] = {"Parent_Info": p_info["details"], "Students_Info": [], "School_Name": school_name}
-            else:
-                processed_data[email_key]["Parent_Info"].update(p_info["details"])
-            current_students = processed_data[email_key]["Students_Info"]
-            if len(current_students) < max_students and (student_info.get("ID Number") is None or not any(s.get("ID Number") == student_info.get("ID Number") for s in current_students)):
-                current_students.append(student_info)
-
-    output_rows = []
-    parent_cols = ["Firstname", "Lastname", "SMS", "Is FacultyStaff", "Street Address", "City", "State", "ZIP Code"]
-    output_cols = ["Email", "School Name"] + parent_cols
-    for i in range(1, max_students + 1):
-        for base_name in output_student_base_names.values(): output_cols.append(f"{base_name} Student {i}")
-
-    for email, data in processed_data.items():
-        row_data = {"Email": email, "School Name": data.get("School_Name")}
-        row_data.update(data["Parent_Info"])
-        s_list = data["Students_Info"]
-        for i in range(max_students):
-            s_suffix = i + 1
-            if i < len(s_list):
-                s = s_list[i]
-                for orig_col, base_name in output_student_base_names.items(): row_data[f"{base_name} Student {s_suffix}"] = s.get(orig_col)
-            else:
-                for base_name in output_student_base_names.values(): row_data[f"{base_name} Student {s_suffix}"] = None
-        output_rows.append(row_data)
-    
-    output_df = pd.DataFrame(output_rows, columns=output_cols)
+    # Stack the Parent 1 / Parent 2 column blocks into one long-form frame so the
+    # aggregation below runs on pandas' C kernels instead of a per-row Python loop.
+    halves = []
+    for i in [1, 2]:
+        rename_map = {f'Parent {i} Email': 'Email'}
+        rename_map.update({f'Parent {i} {src}': dst for src, dst in _PARENT_FIELD_MAP.items()})
+        rename_map.update(_STUDENT_BASE_NAMES)
+        halves.append(df[['School Name', *rename_map]].rename(columns=rename_map))
+    # Stable sort restores original row order with Parent 1 ahead of Parent 2.
+    long_df = pd.concat(halves).sort_index(kind='stable')
+    # Release the wide input frame before aggregating: the reader (calamine)
+    # and writer (constant_memory) already stream, so the long-form frame is
+    # the biggest allocation left and peak RSS should not also include the
+    # original 25-column frame it was built from.
+    del df, halves
+
+    # Normalize emails in one vectorized pass and drop rows without a parent email.
+    long_df['Email'] = long_df['Email'].astype('string[pyarrow]').str.strip().str.lower()
+    long_df = long_df[long_df['Email'].notna() & (long_df['Email'] != '')]
+    long_df['Is FacultyStaff'] = _normalize_boolean_series(long_df['Is FacultyStaff'])
+
+    # One output row per unique parent email; first occurrence wins per field.
+    parent_info = long_df.groupby('Email', sort=False)[['School Name'] + _PARENT_COLS].first()
+
+    # Dedupe students per parent, keep at most MAX_STUDENTS, and pivot them into
+    # the "<field> Student <n>" wide layout.
+    student_bases = list(_STUDENT_BASE_NAMES.values())
+    students = long_df[['Email'] + student_bases].drop_duplicates(['Email', 'ID Number'])
+    students = students.assign(slot=students.groupby('Email', sort=False).cumcount() + 1)
+    students = students[students['slot'] <= MAX_STUDENTS]
+    student_wide = students.pivot(index='Email', columns='slot', values=student_bases)
+    student_wide.columns = [f"{base} Student {slot}" for base, slot in student_wide.columns]
+
+    output_df = parent_info.join(student_wide).reset_index().reindex(columns=OUTPUT_COLS)
     try:
-        output_df.to_excel(output_server_filepath, index=False)
-        app.logger.info(f"Processed data saved to: {output_server_filepath}")
+        _write_output_excel(output_df, output_target)
+        app.logger.info("Processed %d parent rows into output workbook.", len(output_df))
         return True, None
     except Exception as e:
-        app.logger.error(f"Error writing output Excel {output_server_filepath}: {e}", exc_info=True)
+        app.logger.error(f"Error writing output Excel: {e}", exc_info=True)
         return False, f"Error writing output Excel file: {e}"
 
+# --- Background Conversion Jobs ---
+# Large uploads used to pin a WSGI worker for the whole parse-process-write
+# cycle. Conversions can instead be queued on this executor and polled by job
+# id, so the upload request returns immediately. An in-process executor is
+# used rather than Celery/RQ because this deployment has no broker; the job
+# registry therefore lives (and dies) with the worker process.
+_JOB_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("JOB_WORKERS", "2")))
+_JOBS = {}
+_JOBS_LOCK = threading.Lock()
+# Finished entries hold the whole output workbook in a BytesIO, so jobs the
+# client never downloads (or failed jobs it stops polling) must not live for
+# the life of the worker process. Terminal entries older than this TTL are
+# swept every time a new job is queued.
+_JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_MINUTES", "15")) * 60
+
+def _evict_stale_jobs():
+    with _JOBS_LOCK:
+        cutoff = time.monotonic() - _JOB_TTL_SECONDS
+        stale = [job_id for job_id, job in _JOBS.items()
+                 if job["state"] in ("finished", "failed") and job["done_at"] <= cutoff]
+        for job_id in stale:
+            del _JOBS[job_id]
+    if stale:
+        app.logger.info("Evicted %d abandoned job(s) past their TTL.", len(stale))
+
+def _run_conversion_job(job_id, uploaded_file_path, original_filename):
+    output_buffer = io.BytesIO()
+    try:
+        success, error_message = process_uploaded_spreadsheet(uploaded_file_path, output_buffer)
+    except Exception as e:
+        app.logger.error(f"Job {job_id} failed unexpectedly: {e}", exc_info=True)
+        success, error_message = False, "An internal server error occurred."
+    finally:
+        _remove_file(uploaded_file_path)
+    with _JOBS_LOCK:
+        job = _JOBS[job_id]
+        if success:
+            output_buffer.seek(0)
+            job.update({"state": "finished", "result": output_buffer,
+                        "download_name": generate_output_download_name(original_filename),
+                        "done_at": time.monotonic()})
+        else:
+            job.update({"state": "failed", "error": error_message or "Error processing file.",
+                        "done_at": time.monotonic()})
+
+@app.route('/api/upload-excel-async', methods=['POST', 'OPTIONS'])
+def upload_excel_async():
+    if request.method == 'OPTIONS': return _build_cors_preflight_response()
+
+    if 'excel_file' not in request.files or not request.files['excel_file'].filename:
+        return jsonify({"success": False, "message": "No file selected."}), 400
+    file = request.files['excel_file']
+    original_filename = file.filename
+    if not original_filename.lower().endswith(_ALLOWED_UPLOAD_EXTS):
+        return jsonify({"success": False, "message": "Invalid file type. Please upload an Excel file (.xlsx or .xls)."}), 400
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(original_filename)[1], dir=UPLOAD_FOLDER_BASE, mode='wb') as tmp_upload_obj:
+        shutil.copyfileobj(file.stream, tmp_upload_obj, length=1024 * 1024)
+        uploaded_file_path = tmp_upload_obj.name
+
+    _evict_stale_jobs()
+    job_id = uuid.uuid4().hex
+    with _JOBS_LOCK:
+        _JOBS[job_id] = {"state": "queued"}
+    _JOB_EXECUTOR.submit(_run_conversion_job, job_id, uploaded_file_path, original_filename)
+    app.logger.info("Queued conversion job %s for '%s'.", job_id, original_filename)
+    return jsonify({"success": True, "job_id": job_id}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "Unknown job id."}), 404
+        state = job["state"]
+        error = job.get("error")
+    payload = {"success": True, "state": state}
+    if error:
+        payload["error"] = error
+    return jsonify(payload)
+
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "Unknown job id."}), 404
+        if job["state"] != "finished":
+            return jsonify({"success": False, "message": f"Job is {job['state']}, not finished."}), 409
+        # One-shot download: drop the registry entry so buffers don't pile up.
+        del _JOBS[job_id]
+    return send_file(
+        job["result"],
+        as_attachment=True,
+        download_name=job["download_name"],
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
 # --- API Routes ---
 @app.route('/api/validate-password', methods=['POST', 'OPTIONS'])
 def validate_password():
@@ -193,7 +418,7 @@ def validate_password():
     if not data or 'password' not in data:
         logging.warning("Password validation: Password not provided.")
         return jsonify({"success": False, "message": "Password not provided."}), 400
-    if data['password'] == EXPECTED_PASSWORD:
+    if hmac.compare_digest(str(data['password']).encode(), _EXPECTED_PW_BYTES):
         logging.info("Password validation successful.")
         return jsonify({"success": True, "message": "Password correct."})
     else:
@@ -214,52 +439,56 @@ def upload_excel():
         return jsonify({"success": False, "message": "No selected file."}), 400
 
     original_filename = file.filename
-    if file and (original_filename.endswith('.xlsx') or original_filename.endswith('.xls')):
+    if file and original_filename.lower().endswith(_ALLOWED_UPLOAD_EXTS):
         logging.info(f"Excel upload: Received file '{original_filename}'.")
         
         uploaded_file_path = None
-        processed_file_path_to_send = None
 
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(original_filename)[1], dir=UPLOAD_FOLDER_BASE, mode='wb') as tmp_upload_obj:
-                file.save(tmp_upload_obj)
-                uploaded_file_path = tmp_upload_obj.name
-            logging.info(f"File '{original_filename}' saved temporarily to '{uploaded_file_path}'.")
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx', dir=PROCESSED_FOLDER_BASE) as tmp_processed_obj:
-                processed_file_path_to_send = tmp_processed_obj.name
-            
-            success, error_message = process_uploaded_spreadsheet(uploaded_file_path, processed_file_path_to_send)
-            _remove_file(uploaded_file_path) 
+            # Small uploads skip the disk round-trip entirely: buffer the body
+            # in memory and let pandas read straight from it. Larger files
+            # still spill to UPLOAD_FOLDER_BASE so a burst of big uploads
+            # cannot exhaust worker memory.
+            in_memory_limit = int(os.environ.get("IN_MEMORY_UPLOAD_MB", "5")) * 1024 * 1024
+            if request.content_length and request.content_length <= in_memory_limit:
+                input_source = io.BytesIO(file.stream.read())
+                logging.info(f"File '{original_filename}' buffered in memory for processing.")
+            else:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(original_filename)[1], dir=UPLOAD_FOLDER_BASE, mode='wb') as tmp_upload_obj:
+                    # 1 MiB buffer instead of file.save()'s 16 KiB chunks.
+                    shutil.copyfileobj(file.stream, tmp_upload_obj, length=1024 * 1024)
+                    uploaded_file_path = tmp_upload_obj.name
+                input_source = uploaded_file_path
+                logging.info(f"File '{original_filename}' saved temporarily to '{uploaded_file_path}'.")
+
+            # Build the output workbook in memory: the result is a few MB at
+            # most, so a disk round-trip plus cleanup callback is pure overhead.
+            output_buffer = io.BytesIO()
+            # Run the conversion on the shared job executor: sync uploads and
+            # queued jobs then draw from one bounded pool (JOB_WORKERS), so a
+            # burst of simultaneous uploads cannot oversubscribe the CPU.
+            future = _JOB_EXECUTOR.submit(process_uploaded_spreadsheet, input_source, output_buffer)
+            success, error_message = future.result()
+            _remove_file(uploaded_file_path)
             uploaded_file_path = None
 
             if success:
                 download_name_str = generate_output_download_name(original_filename)
-                
-                # Log the exact string being passed to send_file
-                app.logger.info(f"Attempting to send file with download_name: '{download_name_str}'")
-
-                @after_this_request
-                def cleanup_sent_file(response):
-                    _remove_file(processed_file_path_to_send)
-                    return response
-                
+                app.logger.info("Attempting to send file with download_name: '%s'", download_name_str)
+                output_buffer.seek(0)
                 return send_file(
-                    processed_file_path_to_send,
+                    output_buffer,
                     as_attachment=True,
                     download_name=download_name_str, # Use the sanitized and logged name
                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
                 )
             else:
                 logging.error(f"Processing failed for uploaded file '{original_filename}': {error_message}")
-                _remove_file(processed_file_path_to_send)
-                processed_file_path_to_send = None
                 return jsonify({"success": False, "message": error_message or "Error processing file."}), 500
 
         except Exception as e:
             logging.error(f"An unexpected error occurred in upload_excel: {e}", exc_info=True)
             _remove_file(uploaded_file_path)
-            _remove_file(processed_file_path_to_send)
             return jsonify({"success": False, "message": "An internal server error occurred."}), 500
 
     else: 
@@ -276,5 +505,7 @@ def _build_cors_preflight_response():
     return response, 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Dev server only; production runs under gunicorn (see gunicorn.conf.py).
+    # The debugger/reloader add per-request overhead, so they are opt-in now.
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1')
 
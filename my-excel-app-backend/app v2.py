@@ -1,23 +1,45 @@
+import io
 import os
+import hmac
 import logging
 import pandas as pd
 import tempfile
+import shutil
 import re
-from flask import Flask, request, jsonify, send_file, make_response, after_this_request
+import xlsxwriter
+from functools import lru_cache
+from flask import Flask, request, jsonify, send_file, make_response
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+try:
+    import python_calamine  # noqa: F401
+    _CALAMINE_AVAILABLE = True
+except ImportError:
+    _CALAMINE_AVAILABLE = False
+
 load_dotenv()
 
 # --- Basic Configuration & Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Compiled once at import instead of per request in generate_output_download_name.
+_SANITIZE_KEEP_RE = re.compile(r'[^\w\s-]')
+
+# One tuple-argument endswith call per upload instead of two string checks;
+# lowercasing first means '.XLSX' files from Windows clients are accepted.
+_ALLOWED_UPLOAD_EXTS = ('.xlsx', '.xls')
+
 app = Flask(__name__)
+# Cap upload size so a single oversized file cannot exhaust worker memory, and
+# keep the multipart parser's in-memory buffer small so bodies spool to disk.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+app.config['MAX_FORM_MEMORY_SIZE'] = 1024 * 1024
 EXPECTED_PASSWORD = os.environ.get("APP_PASSWORD", "yourSuperSecretPassword123")
+# Encoded once at import; compare_digest wants bytes and runs in constant time.
+_EXPECTED_PW_BYTES = EXPECTED_PASSWORD.encode()
 UPLOAD_FOLDER_BASE = 'uploads_temp'
-PROCESSED_FOLDER_BASE = 'processed_temp'
 os.makedirs(UPLOAD_FOLDER_BASE, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER_BASE, exist_ok=True)
 
 # --- CORS Configuration ---
 LOCAL_FRONTEND_URL = os.environ.get("LOCAL_FRONTEND_URL", "http://localhost:5173")
@@ -36,115 +58,186 @@ CORS(app, resources={
 
 # --- Helper Functions ---
 def _remove_file(path):
-    """Safely remove a file if it exists."""
+    """Safely remove a file if it exists.
+
+    Uses a single unlink instead of exists()+remove(): one syscall fewer and
+    no TOCTOU race between the existence check and the delete.
+    """
+    if not path:
+        return
     try:
-        if path and os.path.exists(path):
-            os.remove(path)
-            app.logger.info(f"Successfully removed temp file: {path}")
+        os.unlink(path)
+        app.logger.info("Successfully removed temp file: %s", path)
+    except FileNotFoundError:
+        pass
     except OSError as e:
         app.logger.error(f"Error removing temp file {path}: {e}", exc_info=True)
 
 def _validate_columns(df_columns, expected_cols):
     """Check for missing columns and return a list of them."""
-    return [col for col in expected_cols if col not in df_columns]
+    # One set build plus O(1) lookups instead of scanning the Index per name;
+    # iterating expected_cols keeps the error message in schema order.
+    present = set(df_columns)
+    return [col for col in expected_cols if col not in present]
+
+def _write_output_excel(output_df, output_target):
+    """Write a DataFrame to xlsx (path or file-like target) with xlsxwriter
+    in constant-memory mode.
+
+    constant_memory flushes each row to disk as soon as the next one starts,
+    so the writer never holds the whole sheet in RAM like openpyxl does. It
+    requires strictly row-ordered writes, which is why rows are emitted here
+    with write_row instead of DataFrame.to_excel (pandas writes column-major).
+    """
+    # strings_to_urls off: no cell here should become a hyperlink, and skipping
+    # the URL pattern check saves a regex pass over every string cell.
+    with xlsxwriter.Workbook(output_target, {'constant_memory': True, 'strings_to_urls': False}) as workbook:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, [str(c) for c in output_df.columns])
+        cleaned = output_df.astype(object).where(output_df.notna(), None)
+        for row_num, row in enumerate(cleaned.itertuples(index=False), start=1):
+            worksheet.write_row(row_num, 0, row)
+
+STUDENT_PARENT_EXPECTED_COLS = [
+    'School Name', 'ID Number', 'Student First Name', 'Student Last Name',
+    'Student Grade Level', 'Student Homeroom', 'Parent 1 First Name', 'Parent 1 Last Name',
+    'Parent 1 Email', 'Parent 1 Phone Number', 'Parent 1 Street Address', 'Parent 1 City',
+    'Parent 1 State', 'Parent 1 ZIP Code', 'Parent 2 First Name', 'Parent 2 Last Name',
+    'Parent 2 Email', 'Parent 2 Phone Number', 'Parent 2 Street Address', 'Parent 2 City',
+    'Parent 2 State', 'Parent 2 ZIP Code'
+]
+_STUDENT_PARENT_COL_SET = frozenset(STUDENT_PARENT_EXPECTED_COLS)
+
+FACULTY_STAFF_EXPECTED_COLS = ['School Name', 'ID Number', 'First Name', 'Last Name', 'Email', 'Phone Number', 'Street Address', 'City', 'State', 'ZIP Code']
+_FACULTY_STAFF_COL_SET = frozenset(FACULTY_STAFF_EXPECTED_COLS)
 
 def _process_student_parent_info(df):
     """Processes the Student-Parent information spreadsheet."""
-    expected_cols = [
-        'School Name', 'ID Number', 'Student First Name', 'Student Last Name', 
-        'Student Grade Level', 'Student Homeroom', 'Parent 1 First Name', 'Parent 1 Last Name', 
-        'Parent 1 Email', 'Parent 1 Phone Number', 'Parent 1 Street Address', 'Parent 1 City', 
-        'Parent 1 State', 'Parent 1 ZIP Code', 'Parent 2 First Name', 'Parent 2 Last Name', 
-        'Parent 2 Email', 'Parent 2 Phone Number', 'Parent 2 Street Address', 'Parent 2 City', 
-        'Parent 2 State', 'Parent 2 ZIP Code'
-    ]
-    missing_cols = _validate_columns(df.columns, expected_cols)
+    missing_cols = _validate_columns(df.columns, STUDENT_PARENT_EXPECTED_COLS)
     if missing_cols:
         # MODIFICATION: Create a detailed, multi-line error list.
         error_details = ["Missing columns:", *missing_cols, "---", "Available columns:", *list(df.columns)]
         return False, {"message": "Column mismatch in Student-Parent file.", "details": error_details}
 
-    processed_data = {}
-    for _, row in df.iterrows():
-        student_info = {
-            "ID Number": row.get('ID Number'),
-            "First Name": row.get('Student First Name'),
-            "Last Name": row.get('Student Last Name'),
-            "Grade Level": row.get('Student Grade Level'),
-            "Homeroom": row.get('Student Homeroom')
-        }
-        school_name = row.get("School Name")
-
-        for i in [1, 2]:
-            email = row.get(f'Parent {i} Email')
-            if pd.notna(email) and str(email).strip():
-                email_key = str(email).lower().strip()
-                parent_details = {
-                    "Firstname": row.get(f'Parent {i} First Name'),
-                    "Lastname": row.get(f'Parent {i} Last Name'),
-                    "SMS": row.get(f'Parent {i} Phone Number'),
-                    "Street Address": row.get(f'Parent {i} Street Address'),
-                    "City": row.get(f'Parent {i} City'),
-                    "State": row.get(f'Parent {i} State'),
-                    "ZIP Code": row.get(f'Parent {i} ZIP Code')
-                }
-                
-                if email_key not in processed_data:
-                    processed_data[email_key] = {"Parent_Info": {}, "Students_Info": [], "School_Name": school_name}
-                
-                processed_data[email_key]["Parent_Info"].update({k:v for k,v in parent_details.items() if v})
-                
-                current_students = processed_data[email_key]["Students_Info"]
-                if len(current_students) < 4 and not any(s.get("ID Number") == student_info.get("ID Number") for s in current_students):
-                    current_students.append(student_info)
-
-    output_rows = []
-    for email, data in processed_data.items():
-        row_data = {"Email": email, "School Name": data.get("School_Name")}
-        row_data.update(data["Parent_Info"])
-        for i, s in enumerate(data["Students_Info"]):
-            for key, value in s.items():
-                row_data[f"{key} Student {i+1}"] = value
-        output_rows.append(row_data)
-    
-    return True, pd.DataFrame(output_rows)
+    # Stack the Parent 1 / Parent 2 column blocks into one long-form frame so the
+    # whole aggregation runs on pandas' C kernels instead of a per-row Python loop.
+    student_col_map = {
+        'ID Number': 'ID Number',
+        'Student First Name': 'First Name',
+        'Student Last Name': 'Last Name',
+        'Student Grade Level': 'Grade Level',
+        'Student Homeroom': 'Homeroom'
+    }
+    parent_field_map = {
+        'First Name': 'Firstname', 'Last Name': 'Lastname', 'Phone Number': 'SMS',
+        'Street Address': 'Street Address', 'City': 'City', 'State': 'State', 'ZIP Code': 'ZIP Code'
+    }
+
+    halves = []
+    for i in [1, 2]:
+        rename_map = {f'Parent {i} Email': 'Email'}
+        rename_map.update({f'Parent {i} {src}': dst for src, dst in parent_field_map.items()})
+        rename_map.update(student_col_map)
+        half = df[['School Name', *rename_map]].rename(columns=rename_map)
+        halves.append(half)
+    # Stable sort restores original row order with Parent 1 ahead of Parent 2.
+    long_df = pd.concat(halves).sort_index(kind='stable')
+
+    # Normalize emails in one vectorized pass and drop rows without a parent email.
+    long_df['Email'] = long_df['Email'].astype('string').str.strip().str.lower()
+    long_df = long_df[long_df['Email'].notna() & (long_df['Email'] != '')]
+
+    if long_df.empty:
+        return True, pd.DataFrame()
+
+    # One output row per unique parent email; first occurrence wins per field.
+    parent_cols = ['School Name', *parent_field_map.values()]
+    parent_info = long_df.groupby('Email', sort=False)[parent_cols].first()
+
+    # Dedupe students per parent, keep at most 4, and pivot them into the
+    # "<field> Student <n>" wide layout.
+    students = long_df[['Email', *student_col_map.values()]].drop_duplicates(['Email', 'ID Number'])
+    students = students.assign(slot=students.groupby('Email', sort=False).cumcount() + 1)
+    students = students[students['slot'] <= 4]
+    student_wide = students.pivot(index='Email', columns='slot', values=list(student_col_map.values()))
+    slots = student_wide.columns.get_level_values('slot').unique().sort_values()
+    student_wide = student_wide.reindex(
+        columns=pd.MultiIndex.from_tuples([(base, s) for s in slots for base in student_col_map.values()])
+    )
+    student_wide.columns = [f"{base} Student {slot}" for base, slot in student_wide.columns]
+
+    return True, parent_info.join(student_wide).reset_index()
 
 def _process_faculty_staff_info(df):
     """Processes the Faculty-Staff information spreadsheet."""
-    expected_cols = ['School Name', 'ID Number', 'First Name', 'Last Name', 'Email', 'Phone Number', 'Street Address', 'City', 'State', 'ZIP Code']
-    missing_cols = _validate_columns(df.columns, expected_cols)
+    missing_cols = _validate_columns(df.columns, FACULTY_STAFF_EXPECTED_COLS)
     if missing_cols:
         # MODIFICATION: Create a detailed, multi-line error list.
         error_details = ["Missing columns:", *missing_cols, "---", "Available columns:", *list(df.columns)]
         return False, {"message": "Column mismatch in Faculty-Staff file.", "details": error_details}
 
-    df_renamed = df.rename(columns={
+    output_cols = ['Email', 'School Name', 'Firstname', 'Lastname', 'SMS', 'Street Address', 'City', 'State', 'ZIP Code']
+    # Single chained rename+reindex: with pandas copy-on-write these are lazy
+    # column relabels, so the frame is never materialized twice.
+    return True, df.rename(columns={
         'First Name': 'Firstname',
         'Last Name': 'Lastname',
         'Phone Number': 'SMS'
-    })
-    
-    output_cols = ['Email', 'School Name', 'Firstname', 'Lastname', 'SMS', 'Street Address', 'City', 'State', 'ZIP Code']
-    return True, df_renamed[output_cols]
+    }).reindex(columns=output_cols)
+
+def _read_input_excel(filepath, **kwargs):
+    """Read an Excel file, preferring the Rust-based calamine engine.
+
+    calamine streams the sheet instead of building openpyxl's full workbook
+    object model, which makes it several times faster on large uploads. Falls
+    back to the pandas default engine (openpyxl/xlrd) if the package is not
+    installed or cannot parse the file.
+    """
+    if _CALAMINE_AVAILABLE:
+        try:
+            return pd.read_excel(filepath, engine='calamine', **kwargs)
+        except Exception as e:
+            app.logger.warning(f"calamine engine failed for {filepath} ({e}); retrying with default engine.")
+    return pd.read_excel(filepath, **kwargs)
 
 def process_spreadsheet(filepath, original_filename):
     """Main router function to process spreadsheets based on filename."""
     name_part = os.path.splitext(original_filename)[0]
-    
-    try:
-        df = pd.read_excel(filepath)
-    except Exception as e:
-        app.logger.error(f"Error reading Excel file {original_filename}: {e}", exc_info=True)
-        return False, {"message": f"Could not read the Excel file. It may be corrupted or in an unsupported format.", "details": [str(e)]}
 
+    # Route on the filename before reading: badly named files are rejected
+    # without parsing the workbook, and usecols (a membership callable, so
+    # unknown columns never raise) keeps extra columns out of the frame.
     if name_part.endswith("- StudentParent Information"):
-        return _process_student_parent_info(df)
+        expected_cols, expected_col_set, processor = STUDENT_PARENT_EXPECTED_COLS, _STUDENT_PARENT_COL_SET, _process_student_parent_info
+        mismatch_msg = "Column mismatch in Student-Parent file."
     elif name_part.endswith("- FacultyStaff Information"):
-        return _process_faculty_staff_info(df)
+        expected_cols, expected_col_set, processor = FACULTY_STAFF_EXPECTED_COLS, _FACULTY_STAFF_COL_SET, _process_faculty_staff_info
+        mismatch_msg = "Column mismatch in Faculty-Staff file."
     else:
         err_msg = "Invalid file name. Name must end with '- StudentParent Information' or '- FacultyStaff Information'."
         return False, {"message": err_msg, "details": [f"Your filename: '{original_filename}'"]}
 
+    try:
+        df = _read_input_excel(filepath, usecols=expected_col_set.__contains__)
+    except Exception as e:
+        app.logger.error(f"Error reading Excel file {original_filename}: {e}", exc_info=True)
+        return False, {"message": f"Could not read the Excel file. It may be corrupted or in an unsupported format.", "details": [str(e)]}
+
+    missing_cols = _validate_columns(df.columns, expected_cols)
+    if missing_cols:
+        # The projected read drops unrecognized headers, so re-read just the
+        # header row to list what the file actually contains — a typo'd name
+        # showing up under "Available columns" is the clue the user needs to
+        # fix their template. Failure path only; the happy path keeps usecols.
+        actual_cols = list(_read_input_excel(filepath, nrows=0).columns)
+        error_details = ["Missing columns:", *missing_cols, "---", "Available columns:", *actual_cols]
+        return False, {"message": mismatch_msg, "details": error_details}
+
+    return processor(df)
+
+# Schools re-upload the same few workbooks all day, so the sanitize work is
+# memoized; filenames are capped strings, so the cache stays tiny.
+@lru_cache(maxsize=256)
 def generate_output_download_name(original_input_basename):
     """Generates a sanitized output filename."""
     name_part_without_ext = os.path.splitext(original_input_basename)[0]
@@ -156,7 +249,7 @@ def generate_output_download_name(original_input_basename):
     else:
         base_name = name_part_without_ext
 
-    sanitized_base = re.sub(r'[^\w\s-]', '', base_name).strip()
+    sanitized_base = _SANITIZE_KEEP_RE.sub('', base_name).strip()
     return f"{sanitized_base} - Brevo Contacts.xlsx"
 
 # --- API Routes ---
@@ -164,7 +257,7 @@ def generate_output_download_name(original_input_basename):
 def validate_password():
     if request.method == 'OPTIONS': return make_response(), 200
     data = request.get_json()
-    if data and data.get('password') == EXPECTED_PASSWORD:
+    if data and hmac.compare_digest(str(data.get('password', '')).encode(), _EXPECTED_PW_BYTES):
         return jsonify({"success": True})
     return jsonify({"success": False, "message": "Invalid password."}), 401
 
@@ -178,14 +271,14 @@ def upload_excel():
     file = request.files['excel_file']
     original_filename = file.filename
     
-    if not (original_filename.endswith('.xlsx') or original_filename.endswith('.xls')):
+    if not original_filename.lower().endswith(_ALLOWED_UPLOAD_EXTS):
         return jsonify({"success": False, "message": "Invalid file type. Please upload an .xlsx or .xls file."}), 400
 
     uploaded_file_path = None
-    processed_file_path = None
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(original_filename)[1], dir=UPLOAD_FOLDER_BASE) as tmp_upload:
-            file.save(tmp_upload)
+            # 1 MiB buffer instead of file.save()'s 16 KiB chunks.
+            shutil.copyfileobj(file.stream, tmp_upload, length=1024 * 1024)
             uploaded_file_path = tmp_upload.name
 
         success, result = process_spreadsheet(uploaded_file_path, original_filename)
@@ -195,20 +288,20 @@ def upload_excel():
             return jsonify({"success": False, **result}), 400
 
         output_df = result
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx', dir=PROCESSED_FOLDER_BASE) as tmp_processed:
-            processed_file_path = tmp_processed.name
-        output_df.to_excel(processed_file_path, index=False)
-        
+        # Build the workbook straight into memory: the output is a single
+        # modest sheet, so buffering it in a BytesIO skips the write-to-disk/
+        # read-back round-trip and leaves nothing on disk to clean up.
+        output_buffer = io.BytesIO()
+        _write_output_excel(output_df, output_buffer)
+        output_buffer.seek(0)
+
         download_name = generate_output_download_name(original_filename)
 
-        @after_this_request
-        def cleanup(response):
-            _remove_file(uploaded_file_path)
-            _remove_file(processed_file_path)
-            return response
-            
+        _remove_file(uploaded_file_path)
+        uploaded_file_path = None
+
         return send_file(
-            processed_file_path,
+            output_buffer,
             as_attachment=True,
             download_name=download_name,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -217,8 +310,9 @@ def upload_excel():
     except Exception as e:
         app.logger.error(f"An unexpected error occurred in upload_excel: {e}", exc_info=True)
         _remove_file(uploaded_file_path)
-        _remove_file(processed_file_path)
         return jsonify({"success": False, "message": "An internal server error occurred.", "details": [str(e)]}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Local development only — serve production traffic through gunicorn
+    # (see startup.sh) rather than the single-threaded Werkzeug dev server.
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -1,24 +1,64 @@
 import os
+import io
+import hmac
 import logging
+import numpy as np
 import pandas as pd
 import tempfile
 import re
 import shutil
+import xlsxwriter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from flask import Flask, request, jsonify, send_file, make_response, after_this_request
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+try:
+    import python_calamine  # noqa: F401
+    _CALAMINE_AVAILABLE = True
+except ImportError:
+    _CALAMINE_AVAILABLE = False
+
 load_dotenv()
 
 # --- Basic Configuration & Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Processing functions log through the module logger (not app.logger) so they
+# keep working when executed in the parsing worker processes.
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Cap upload size so a single oversized file cannot exhaust worker memory, and
+# keep the multipart parser's in-memory buffer small so bodies spool to disk.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+app.config['MAX_FORM_MEMORY_SIZE'] = 1024 * 1024
 EXPECTED_PASSWORD = os.environ.get("APP_PASSWORD", "password")
-# A single base directory for all temporary files and directories.
-UPLOAD_FOLDER_BASE = 'uploads_temp'
+# Encoded once at import; compare_digest wants bytes and runs in constant time.
+_EXPECTED_PW_BYTES = EXPECTED_PASSWORD.encode()
+# One anchored scan decides the spreadsheet type instead of two endswith
+# passes over the filename.
+_SUFFIX_RE = re.compile(r'- (StudentParent|FacultyStaff) Information$')
+# One splitext + set lookup instead of two endswith scans; lowercasing first
+# means '.XLSX' files from Windows clients are accepted.
+_ALLOWED_UPLOAD_EXTS = frozenset({'.xlsx', '.xls'})
+
+# A single base directory for all temporary files. Defaults to a tmpfs
+# (RAM-backed) directory on Linux so spill files cost no disk I/O or inode
+# churn; falls back to a local directory where /dev/shm does not exist.
+UPLOAD_FOLDER_BASE = os.environ.get(
+    'UPLOAD_DIR', '/dev/shm/uploads_temp' if os.path.isdir('/dev/shm') else 'uploads_temp'
+)
 os.makedirs(UPLOAD_FOLDER_BASE, exist_ok=True)
 
+# XLSX parsing is CPU-bound and fights the GIL on threaded workers, so large
+# (on-disk) uploads are parsed in separate processes. The pool is lazy: child
+# processes only spawn on first submit, which keeps import cheap under
+# gunicorn. Small in-memory uploads stay in the request thread because a
+# BytesIO cannot be pickled across the process boundary (and they parse in
+# milliseconds anyway).
+_PARSE_POOL = ProcessPoolExecutor(max_workers=int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 2)))
+
 # --- CORS Configuration ---
 LOCAL_FRONTEND_URL = os.environ.get("LOCAL_FRONTEND_URL", "http://localhost:5173")
 AZURE_FRONTEND_URL = os.environ.get("FRONTEND_URL")
@@ -36,18 +76,32 @@ CORS(app, resources={
 
 # --- Helper & Processing Functions ---
 
-def _remove_dir(path):
-    """Safely remove a directory and all its contents if it exists."""
+def _remove_file(path):
+    """Safely remove a file if it exists."""
+    # Single unlink instead of exists()+remove(): one syscall fewer and no
+    # TOCTOU race with the after_this_request cleanup callback.
+    if not path:
+        return
     try:
-        if path and os.path.exists(path):
-            shutil.rmtree(path)
-            app.logger.info(f"Successfully removed temp directory: {path}")
+        os.unlink(path)
+        app.logger.info("Successfully removed temp file: %s", path)
+    except FileNotFoundError:
+        pass
     except OSError as e:
-        app.logger.error(f"Error removing temp directory {path}: {e}", exc_info=True)
+        app.logger.error(f"Error removing temp file {path}: {e}", exc_info=True)
+
+# Schools upload the same template all day, so the membership check is
+# memoized on the header fingerprint; a new or fixed template is just a cache
+# miss. Tuples keep both arguments hashable.
+@lru_cache(maxsize=64)
+def _missing_columns(column_fingerprint, expected_fingerprint):
+    present = set(column_fingerprint)
+    # Iterating the expected names keeps the error message in schema order.
+    return tuple(col for col in expected_fingerprint if col not in present)
 
 def _validate_columns(df_columns, expected_cols):
     """Check for missing columns and return a list of them."""
-    return [col for col in expected_cols if col not in df_columns]
+    return list(_missing_columns(tuple(df_columns), tuple(expected_cols)))
 
 def _format_sms_number(phone_number):
     """Formats a phone number to be digits only and start with a '1'."""
@@ -64,65 +118,87 @@ def _format_sms_number(phone_number):
         
     return digits_only
 
+STUDENT_PARENT_EXPECTED_COLS = [
+    'School Name', 'ID Number', 'Student First Name', 'Student Last Name',
+    'Student Grade Level', 'Student Homeroom', 'Parent 1 First Name', 'Parent 1 Last Name',
+    'Parent 1 Email', 'Parent 1 Phone Number', 'Parent 1 Street Address', 'Parent 1 City',
+    'Parent 1 State', 'Parent 1 ZIP Code', 'Parent 2 First Name', 'Parent 2 Last Name',
+    'Parent 2 Email', 'Parent 2 Phone Number', 'Parent 2 Street Address', 'Parent 2 City',
+    'Parent 2 State', 'Parent 2 ZIP Code'
+]
+_STUDENT_PARENT_COL_SET = frozenset(STUDENT_PARENT_EXPECTED_COLS)
+
+FACULTY_STAFF_EXPECTED_COLS = ['School Name', 'ID Number', 'First Name', 'Last Name', 'Email', 'Phone Number', 'Street Address', 'City', 'State', 'ZIP Code']
+_FACULTY_STAFF_COL_SET = frozenset(FACULTY_STAFF_EXPECTED_COLS)
+
+# Low-cardinality columns become categoricals (int codes instead of N string
+# objects) and IDs read as 'string' so they are never promoted to float.
+# Grade level stays untyped because schools mix numeric grades with 'K'.
+_STUDENT_PARENT_DTYPES = {
+    'ID Number': 'string', 'School Name': 'category',
+    'Parent 1 State': 'category', 'Parent 2 State': 'category',
+}
+_FACULTY_STAFF_DTYPES = {'ID Number': 'string', 'School Name': 'category', 'State': 'category'}
+
 def _process_student_parent_info(df):
     """Processes the Student-Parent information spreadsheet."""
-    expected_cols = [
-        'School Name', 'ID Number', 'Student First Name', 'Student Last Name',
-        'Student Grade Level', 'Student Homeroom', 'Parent 1 First Name', 'Parent 1 Last Name',
-        'Parent 1 Email', 'Parent 1 Phone Number', 'Parent 1 Street Address', 'Parent 1 City',
-        'Parent 1 State', 'Parent 1 ZIP Code', 'Parent 2 First Name', 'Parent 2 Last Name',
-        'Parent 2 Email', 'Parent 2 Phone Number', 'Parent 2 Street Address', 'Parent 2 City',
-        'Parent 2 State', 'Parent 2 ZIP Code'
-    ]
-    missing_cols = _validate_columns(df.columns, expected_cols)
+    missing_cols = _validate_columns(df.columns, STUDENT_PARENT_EXPECTED_COLS)
     if missing_cols:
         error_details = ["Missing columns:", *missing_cols, "---", "Available columns:", *list(df.columns)]
         return False, {"message": "Column mismatch in Student-Parent file.", "details": error_details}
 
-    processed_data = {}
-    for _, row in df.iterrows():
-        student_info = {
-            "ID Number": row.get('ID Number'),
-            "First Name": row.get('Student First Name'),
-            "Last Name": row.get('Student Last Name'),
-            "Grade Level": row.get('Student Grade Level'),
-            "Homeroom": row.get('Student Homeroom')
-        }
-        school_name = row.get("School Name")
-
-        for i in [1, 2]:
-            email = row.get(f'Parent {i} Email')
-            if pd.notna(email) and str(email).strip():
-                email_key = str(email).lower().strip()
-                parent_details = {
-                    "Firstname": row.get(f'Parent {i} First Name'),
-                    "Lastname": row.get(f'Parent {i} Last Name'),
-                    "SMS": _format_sms_number(row.get(f'Parent {i} Phone Number')),
-                    "Street Address": row.get(f'Parent {i} Street Address'),
-                    "City": row.get(f'Parent {i} City'),
-                    "State": row.get(f'Parent {i} State'),
-                    "ZIP Code": row.get(f'Parent {i} ZIP Code')
-                }
-                if email_key not in processed_data:
-                    processed_data[email_key] = {"Parent_Info": {}, "Students_Info": [], "School_Name": school_name}
-                processed_data[email_key]["Parent_Info"].update({k: v for k, v in parent_details.items() if v})
-                current_students = processed_data[email_key]["Students_Info"]
-                if len(current_students) < 4 and not any(s.get("ID Number") == student_info.get("ID Number") for s in current_students):
-                    current_students.append(student_info)
-
-    output_rows = []
-    for email, data in processed_data.items():
-        row_data = {"Email": email, "School Name": data.get("School_Name")}
-        row_data.update(data["Parent_Info"])
-        for i, s in enumerate(data["Students_Info"]):
-            for key, value in s.items():
-                row_data[f"{key} Student {i+1}"] = value
-        output_rows.append(row_data)
-
-    if not output_rows:
+    # Stack the Parent 1 / Parent 2 column blocks into one long-form frame so
+    # the whole aggregation runs on pandas' C kernels instead of a per-row
+    # Python loop over namedtuples.
+    student_col_map = {
+        'ID Number': 'ID Number',
+        'Student First Name': 'First Name',
+        'Student Last Name': 'Last Name',
+        'Student Grade Level': 'Grade Level',
+        'Student Homeroom': 'Homeroom'
+    }
+    parent_field_map = {
+        'First Name': 'Firstname', 'Last Name': 'Lastname', 'Phone Number': 'SMS',
+        'Street Address': 'Street Address', 'City': 'City', 'State': 'State', 'ZIP Code': 'ZIP Code'
+    }
+
+    halves = []
+    for i in [1, 2]:
+        rename_map = {f'Parent {i} Email': 'Email'}
+        rename_map.update({f'Parent {i} {src}': dst for src, dst in parent_field_map.items()})
+        rename_map.update(student_col_map)
+        halves.append(df[['School Name', *rename_map]].rename(columns=rename_map))
+    # Stable sort restores original row order with Parent 1 ahead of Parent 2.
+    long_df = pd.concat(halves).sort_index(kind='stable')
+
+    # Normalize emails in one vectorized pass and drop rows without a parent
+    # email. The arrow-backed string dtype keeps the values in one contiguous
+    # Arrow buffer instead of a Python object per cell, so strip/lower run in
+    # Arrow C kernels.
+    long_df['Email'] = long_df['Email'].astype('string[pyarrow]').str.strip().str.lower()
+    long_df = long_df[long_df['Email'].notna() & (long_df['Email'] != '')]
+
+    if long_df.empty:
         return True, pd.DataFrame()
 
-    output_df = pd.DataFrame(output_rows)
+    # Digits-only phone with a leading '1', same as _format_sms_number but in
+    # two vectorized passes; empty results become NA so a parent row without a
+    # number does not shadow one from a later row that has it.
+    sms = long_df['SMS'].astype('string[pyarrow]').str.replace(r'\D', '', regex=True).replace('', pd.NA)
+    long_df['SMS'] = sms.where(sms.isna() | sms.str.startswith('1'), '1' + sms)
+
+    # One output row per unique parent email; first occurrence wins per field.
+    parent_info = long_df.groupby('Email', sort=False)[['School Name', *parent_field_map.values()]].first()
+
+    # Dedupe students per parent, keep at most 4, and pivot them into the
+    # "<field> Student <n>" wide layout.
+    students = long_df[['Email', *student_col_map.values()]].drop_duplicates(['Email', 'ID Number'])
+    students = students.assign(slot=students.groupby('Email', sort=False).cumcount() + 1)
+    students = students[students['slot'] <= 4]
+    student_wide = students.pivot(index='Email', columns='slot', values=list(student_col_map.values()))
+    student_wide.columns = [f"{base} Student {slot}" for base, slot in student_wide.columns]
+
+    output_df = parent_info.join(student_wide).reset_index()
     output_df['Is FacultyStaff'] = 'No'
 
     final_cols_order = [
@@ -139,59 +215,110 @@ def _process_student_parent_info(df):
 
 def _process_faculty_staff_info(df):
     """Processes the Faculty-Staff information spreadsheet."""
-    expected_cols = ['School Name', 'ID Number', 'First Name', 'Last Name', 'Email', 'Phone Number', 'Street Address', 'City', 'State', 'ZIP Code']
-    missing_cols = _validate_columns(df.columns, expected_cols)
+    missing_cols = _validate_columns(df.columns, FACULTY_STAFF_EXPECTED_COLS)
     if missing_cols:
         error_details = ["Missing columns:", *missing_cols, "---", "Available columns:", *list(df.columns)]
         return False, {"message": "Column mismatch in Faculty-Staff file.", "details": error_details}
 
-    # --- MODIFIED SECTION ---
-    # Apply the SMS formatting to the 'Phone Number' column
-    df['Phone Number'] = df['Phone Number'].apply(_format_sms_number)
-
-    # Rename columns to match the desired output. 'ID Number' is kept as is.
-    df_renamed = df.rename(columns={
-        'First Name': 'Firstname',
-        'Last Name': 'Lastname',
-        'Phone Number': 'SMS'
+    # Single-pass construction: one dict of column references instead of the
+    # old rename + scalar assignment + reorder chain, each of which
+    # materialized another frame. The constant column is one np.full memset
+    # rather than a pandas broadcast assignment. 'ID Number' is kept as is.
+    return True, pd.DataFrame({
+        'Email': df['Email'],
+        'School Name': df['School Name'],
+        'Firstname': df['First Name'],
+        'Lastname': df['Last Name'],
+        'SMS': df['Phone Number'].apply(_format_sms_number),
+        'Is FacultyStaff': np.full(len(df), 'Yes', dtype=object),
+        'Street Address': df['Street Address'],
+        'City': df['City'],
+        'State': df['State'],
+        'ZIP Code': df['ZIP Code'],
+        'ID Number': df['ID Number'],
     })
-    df_renamed['Is FacultyStaff'] = 'Yes'
 
-    # Define the exact output column order as requested, now using 'ID Number'.
-    output_cols = [
-        'Email', 'School Name', 'Firstname', 'Lastname', 'SMS', 'Is FacultyStaff',
-        'Street Address', 'City', 'State', 'ZIP Code', 'ID Number'
-    ]
-    # --- END MODIFIED SECTION ---
-
-    final_df = df_renamed.reindex(columns=output_cols)
-    return True, final_df
+def _write_output_excel(output_df, output_target):
+    """Write a DataFrame to xlsx (path or file-like target) with xlsxwriter
+    in constant-memory mode.
+
+    constant_memory flushes each row to disk as soon as the next one starts,
+    so the writer never holds the whole sheet in RAM like openpyxl does. It
+    requires strictly row-ordered writes, which is why rows are emitted here
+    with write_row instead of DataFrame.to_excel (pandas writes column-major).
+    strings_to_urls is off so email cells skip the URL-detection regex.
+    """
+    with xlsxwriter.Workbook(output_target, {'constant_memory': True, 'strings_to_urls': False}) as workbook:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, [str(c) for c in output_df.columns])
+        cleaned = output_df.astype(object).where(output_df.notna(), None)
+        for row_num, row in enumerate(cleaned.itertuples(index=False), start=1):
+            worksheet.write_row(row_num, 0, row)
+
+def _read_input_excel(filepath, **kwargs):
+    """Read an Excel file, preferring the Rust-based calamine engine.
+
+    calamine streams the sheet instead of building openpyxl's full workbook
+    object model, which makes it several times faster on large uploads. Falls
+    back to the pandas default engine (openpyxl/xlrd) if the package is not
+    installed or cannot parse the file.
+    """
+    if _CALAMINE_AVAILABLE:
+        try:
+            return pd.read_excel(filepath, engine='calamine', **kwargs)
+        except Exception as e:
+            logger.warning(f"calamine engine failed for {filepath} ({e}); retrying with default engine.")
+    return pd.read_excel(filepath, **kwargs)
 
 def process_spreadsheet(filepath, original_filename):
     """Main router function to process spreadsheets based on filename."""
     name_part = os.path.splitext(original_filename)[0]
-    try:
-        app.logger.info(f"Processing file: '{original_filename}'")
-        df = pd.read_excel(filepath)
-    except Exception as e:
-        app.logger.error(f"Error reading Excel file {original_filename}: {e}", exc_info=True)
-        return False, {"message": f"Could not read the Excel file. It may be corrupted or in an unsupported format.", "details": [str(e)]}
 
-    if name_part.endswith("- StudentParent Information"):
-        return _process_student_parent_info(df)
-    elif name_part.endswith("- FacultyStaff Information"):
-        return _process_faculty_staff_info(df)
-    else:
+    # Route on the filename before reading: badly named files are rejected
+    # without parsing the workbook, and usecols (a membership callable, so
+    # unknown columns never raise) keeps extra columns out of the frame. The
+    # dtype map avoids a later astype pass and keeps IDs from being promoted
+    # to float.
+    suffix_match = _SUFFIX_RE.search(name_part)
+    if suffix_match is None:
         err_msg = "Invalid file name. Name must end with '- StudentParent Information' or '- FacultyStaff Information'."
-        app.logger.warning(f"{err_msg} (Filename: '{original_filename}')")
+        logger.warning(f"{err_msg} (Filename: '{original_filename}')")
         return False, {"message": err_msg, "details": [f"Your filename: '{original_filename}'"]}
 
-def generate_output_download_name(original_input_basename):
+    if suffix_match.group(1) == 'StudentParent':
+        expected_cols, expected_col_set, dtypes, processor = STUDENT_PARENT_EXPECTED_COLS, _STUDENT_PARENT_COL_SET, _STUDENT_PARENT_DTYPES, _process_student_parent_info
+        mismatch_msg = "Column mismatch in Student-Parent file."
+    else:
+        expected_cols, expected_col_set, dtypes, processor = FACULTY_STAFF_EXPECTED_COLS, _FACULTY_STAFF_COL_SET, _FACULTY_STAFF_DTYPES, _process_faculty_staff_info
+        mismatch_msg = "Column mismatch in Faculty-Staff file."
+
+    try:
+        logger.info("Processing file: '%s'", original_filename)
+        df = _read_input_excel(filepath, usecols=expected_col_set.__contains__, dtype=dtypes)
+    except Exception as e:
+        logger.error(f"Error reading Excel file {original_filename}: {e}", exc_info=True)
+        return False, {"message": f"Could not read the Excel file. It may be corrupted or in an unsupported format.", "details": [str(e)]}
+
+    missing_cols = _validate_columns(df.columns, expected_cols)
+    if missing_cols:
+        # The projected read drops unrecognized headers, so re-read just the
+        # header row to list what the file actually contains — a typo'd name
+        # showing up under "Available columns" is the clue the user needs to
+        # fix their template. Failure path only; the happy path keeps usecols.
+        if hasattr(filepath, 'seek'):
+            filepath.seek(0)
+        actual_cols = list(_read_input_excel(filepath, nrows=0).columns)
+        error_details = ["Missing columns:", *missing_cols, "---", "Available columns:", *actual_cols]
+        return False, {"message": mismatch_msg, "details": error_details}
+
+    return processor(df)
+
+def generate_output_download_name(original_input_basename, extension='xlsx'):
     """Generates an output filename by appending ' - Brevo' to the original name."""
     name_part_without_ext = os.path.splitext(original_input_basename)[0]
     new_name = f"{name_part_without_ext} - Brevo"
-    final_download_name = f"{new_name}.xlsx"
-    app.logger.info(f"Generated output filename: '{final_download_name}' from original '{original_input_basename}'")
+    final_download_name = f"{new_name}.{extension}"
+    app.logger.info("Generated output filename: '%s' from original '%s'", final_download_name, original_input_basename)
     return final_download_name
 
 # --- API Routes ---
@@ -199,7 +326,7 @@ def generate_output_download_name(original_input_basename):
 def validate_password():
     if request.method == 'OPTIONS': return make_response(), 200
     data = request.get_json()
-    if data and data.get('password') == EXPECTED_PASSWORD:
+    if data and hmac.compare_digest(str(data.get('password', '')).encode(), _EXPECTED_PW_BYTES):
         return jsonify({"success": True})
     return jsonify({"success": False, "message": "Invalid password."}), 401
 
@@ -212,43 +339,108 @@ def upload_excel():
     file = request.files['excel_file']
     original_filename = file.filename
     
-    if not (original_filename.endswith('.xlsx') or original_filename.endswith('.xls')):
+    input_ext = os.path.splitext(original_filename)[1].lower()
+    if input_ext not in _ALLOWED_UPLOAD_EXTS:
         return jsonify({"success": False, "message": "Invalid file type. Please upload an .xlsx or .xls file."}), 400
-    
-    temp_dir = None
-    try:
-        temp_dir = tempfile.mkdtemp(dir=UPLOAD_FOLDER_BASE)
-        uploaded_file_path = os.path.join(temp_dir, original_filename)
-        file.save(uploaded_file_path)
 
-        success, result = process_spreadsheet(uploaded_file_path, original_filename)
+    # ?format=csv skips workbook generation entirely: to_csv is a single
+    # text serialization pass, an order of magnitude cheaper than zipping
+    # up an xlsx, and plenty for clients that only re-import the data.
+    output_format = request.args.get('format', 'xlsx').lower()
+    if output_format not in ('xlsx', 'csv'):
+        return jsonify({"success": False, "message": "Invalid format. Use 'xlsx' or 'csv'."}), 400
+
+    uploaded_file_path = None
+    processed_file_path = None
+    try:
+        # Small uploads skip the disk round-trip entirely: buffer the body in
+        # memory and let pandas read straight from it. Larger files still
+        # spill to UPLOAD_FOLDER_BASE so a burst of big uploads cannot
+        # exhaust worker memory.
+        in_memory_limit = int(os.environ.get("IN_MEMORY_UPLOAD_MB", "5")) * 1024 * 1024
+        if request.content_length and request.content_length <= in_memory_limit:
+            input_source = io.BytesIO(file.stream.read())
+        else:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=input_ext, dir=UPLOAD_FOLDER_BASE) as tmp_upload:
+                # 1 MiB buffer instead of file.save()'s 16 KiB chunks.
+                shutil.copyfileobj(file.stream, tmp_upload, length=1024 * 1024)
+                uploaded_file_path = tmp_upload.name
+            input_source = uploaded_file_path
+
+        if uploaded_file_path is None:
+            success, result = process_spreadsheet(input_source, original_filename)
+        else:
+            # Parse big files in the process pool so this worker thread is
+            # free to serve other requests while the GIL-heavy read runs.
+            future = _PARSE_POOL.submit(process_spreadsheet, input_source, original_filename)
+            success, result = future.result()
 
         if not success:
-            _remove_dir(temp_dir) 
+            _remove_file(uploaded_file_path)
             app.logger.error(f"Processing failed for {original_filename}: {result}")
             return jsonify({"success": False, **result}), 400
 
         output_df = result
-        download_name = generate_output_download_name(original_filename)
+        download_name = generate_output_download_name(original_filename, extension=output_format)
+        if output_format == 'csv':
+            output_mimetype = 'text/csv'
+        else:
+            output_mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+        if uploaded_file_path is None:
+            # In-memory path: serialize the output into a buffer as well, so
+            # the whole conversion never touches the filesystem.
+            output_buffer = io.BytesIO()
+            if output_format == 'csv':
+                output_buffer.write(output_df.to_csv(index=False).encode('utf-8'))
+            else:
+                _write_output_excel(output_df, output_buffer)
+            output_buffer.seek(0)
+            return send_file(
+                output_buffer,
+                as_attachment=True,
+                download_name=download_name,
+                mimetype=output_mimetype
+            )
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{output_format}', dir=UPLOAD_FOLDER_BASE) as tmp_out:
+            processed_file_path = tmp_out.name
+        if output_format == 'csv':
+            output_df.to_csv(processed_file_path, index=False)
+        else:
+            _write_output_excel(output_df, processed_file_path)
+
+        # The upload is consumed; only the output needs to outlive the
+        # request, so cleanup is one unlink instead of a recursive rmtree.
+        _remove_file(uploaded_file_path)
+        uploaded_file_path = None
 
-        processed_file_path = os.path.join(temp_dir, download_name)
-        output_df.to_excel(processed_file_path, index=False)
-        
         @after_this_request
         def cleanup(response):
-            _remove_dir(temp_dir)
+            _remove_file(processed_file_path)
             return response
 
+        # conditional=True makes Flask hand the open file to the WSGI server's
+        # wsgi.file_wrapper (os.sendfile under gunicorn), skipping the
+        # user-space copy of the output bytes; max_age=0 keeps one-shot
+        # conversion results out of caches.
         return send_file(
             processed_file_path,
             as_attachment=True,
             download_name=download_name,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=output_mimetype,
+            conditional=True,
+            max_age=0
         )
     except Exception as e:
-        _remove_dir(temp_dir)
+        _remove_file(uploaded_file_path)
+        _remove_file(processed_file_path)
         app.logger.error(f"An unexpected error occurred in upload_excel: {e}", exc_info=True)
         return jsonify({"success": False, "message": "An internal server error occurred.", "details": [str(e)]}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=True)
\ No newline at end of file
+    # Local development only — production runs under gunicorn (see startup.sh
+    # and gunicorn.conf.py), which parallelizes requests across workers. The
+    # Werkzeug dev server serializes everything, and its reloader/debugger
+    # should never be on unless explicitly requested.
+    app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=os.environ.get('FLASK_DEBUG') == '1')
\ No newline at end of file
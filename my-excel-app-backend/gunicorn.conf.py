@@ -0,0 +1,17 @@
+import multiprocessing
+import os
+
+# Picked up automatically by gunicorn (see startup.sh). Tuned for the Excel
+# conversion workload: gthread workers keep uploads/downloads overlapping
+# while one thread is busy in pandas, and the long timeout covers large files.
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+
+# For download-heavy deployments set GUNICORN_WORKER_CLASS=gevent (requires
+# `pip install gevent`): send_file streaming then yields to other greenlets
+# during socket/disk waits instead of sleeping a whole thread, and concurrent
+# downloads scale with connections rather than workers. worker_connections
+# bounds the greenlets per worker and is ignored by the sync/gthread classes.
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "500"))
@@ -1,2 +1,2 @@
 #!/bin/bash
-gunicorn --bind=0.0.0.0:$PORT --workers=4 app:app
\ No newline at end of file
+gunicorn --bind=0.0.0.0:$PORT app:app